@@ -1,25 +1,58 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 # Literal, Optional など typing からインポート
-from typing import List, Dict, Any, Optional, Literal
+from typing import List, Dict, Any, Optional, Literal, Final
+from typing_extensions import Annotated, NotRequired, TypedDict # pydantic は Python < 3.12 で typing_extensions.TypedDict を要求
 # Pydantic から必要なものをインポート (validator/field_validatorは不要に)
-from pydantic import BaseModel, Field, ValidationError, model_validator
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, model_validator
+import logging
 import math
-import traceback # For detailed error logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+import numpy as np
+import orjson
 from fastapi.middleware.cors import CORSMiddleware # CORS用
-
-app = FastAPI(title="REBA Evaluation API")
+from fastapi.middleware.gzip import GZipMiddleware # レスポンス圧縮用
+from fastapi.responses import ORJSONResponse # 高速JSONレスポンス用
+try:
+    from numba import njit # 数値計算コアのJITコンパイル用 (任意)
+except ImportError: # numba が無い環境ではそのまま NumPy で実行
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]): return args[0]
+        return lambda func: func
+
+# 警告とエラーのみ出力 (ハンドラ未設定のため logging の lastResort 経由で stderr へ)
+logger = logging.getLogger("reba")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時にJITカーネルをコンパイル (またはキャッシュから読み込み) して初回リクエストの遅延を防ぐ
+    angles = compute_angle_array(Landmarks(xy=np.zeros((33, 2)), vis=np.ones(33)), "left")
+    _compute_scores_nb(angles, 0, "standingBoth", "", np.ones(len(_CALIB_FIELDS)))
+    batch_angles = _compute_angles_batch_nb(np.zeros((1, 33, 2)), np.ones((1, 33)), 0)
+    _compute_scores_batch_nb(batch_angles, 0, "standingBoth", "", np.ones(len(_CALIB_FIELDS)))
+    yield
+
+app = FastAPI(title="REBA Evaluation API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # -----------------------------
 # モデル定義 (Pydantic V2 Field制約を使用)
 # -----------------------------
-class Landmark(BaseModel):
-    # x, y は必須とする
-    x: float
-    y: float
-    z: Optional[float] = None # Z座標は任意
-    visibility: Optional[float] = Field(default=None, ge=0.0, le=1.0) # visibility も任意 (0.0-1.0の範囲)
+# TypedDict: pydantic-core が検証済みの dict をそのまま返す (ランドマーク 33 個分のモデル生成を省略)
+class Landmark(TypedDict):
+    # x, y は必須とする (inf / NaN / JSON の Infinity は 422)
+    x: Annotated[float, Field(allow_inf_nan=False)]
+    y: Annotated[float, Field(allow_inf_nan=False)]
+    z: NotRequired[Optional[float]] # Z座標は任意
+    visibility: NotRequired[Optional[Annotated[float, Field(ge=0.0, le=1.0)]]] # visibility も任意 (0.0-1.0の範囲)
 
 class CalibrationInputs(BaseModel):
+    # 検証後は変更しない (結果キャッシュのキーに使うため)。未知のフィールドは従来どおり無視
+    model_config = ConfigDict(frozen=True)
+
     # Literal や Field を使って制約を直接記述
     filmingSide: Literal['left', 'right'] = Field(..., description="left or right")
 
@@ -43,422 +76,501 @@ class CalibrationInputs(BaseModel):
     coupling: Literal[0, 1, 2, 3] = Field(..., description="Coupling score addition (0, 1, 2, or 3)")
 
     # --- Model Validator for supportingLeg (他のフィールド値との関連チェック) ---
+    # 個々のフィールドは Literal / Field で pydantic-core が検証済みなので、ここは関連チェックのみ
     @model_validator(mode='after')
     def check_supporting_leg(self) -> 'CalibrationInputs':
-        # self を通してフィールド値にアクセス
-        # hasattrで存在確認を追加 (より安全に)
-        if hasattr(self, 'postureCategory') and hasattr(self, 'supportingLeg'):
-            posture = self.postureCategory
-            support_leg = self.supportingLeg
-
-            if posture == 'standingOne':
-                # 片足立ちの場合、supportingLeg は "left" か "right" でなければならない
-                if support_leg not in ['left', 'right']:
-                    raise ValueError('Supporting leg ("left" or "right") must be specified for standingOne posture')
-            # standingOne以外でsupportingLegが指定されても Literal['left','right'] または None なので基本OK
-            # (もし厳密にNoneのみを許容するならここでチェック)
-        # 他のバリデーションは Literal や Field で行われるため、ここでは self を返すだけで良い
+        # 片足立ちの場合、supportingLeg は "left" か "right" でなければならない
+        if self.postureCategory == 'standingOne' and self.supportingLeg not in ('left', 'right'):
+            raise ValueError('Supporting leg ("left" or "right") must be specified for standingOne posture')
         return self
 
 class REBAInput(BaseModel):
+    model_config = ConfigDict(frozen=True)
     landmarks: List[Landmark]
     calibInputs: CalibrationInputs
 
+_MAX_BATCH_FRAMES: Final = 300 # Per-frame list building / response dicts hold the GIL, so one request is capped (~10 s of 30 fps video)
+
+class REBABatchInput(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    frames: List[List[Landmark]] = Field(..., max_length=_MAX_BATCH_FRAMES) # e.g. consecutive video frames
+    calibInputs: CalibrationInputs # Shared by every frame
+
+# リクエストボディ検証用 (モジュール読み込み時に一度だけ構築)
+_INPUT_ADAPTER = TypeAdapter(REBAInput)
+_BATCH_ADAPTER = TypeAdapter(REBABatchInput)
+
 # -----------------------------
-# 2D Vector Calculation Helpers
+# Landmark Arrays (Structure of Arrays)
 # -----------------------------
-def parse_point(p: Optional[Dict[str, Any]]) -> Optional[Dict[str, float]]:
-    """ Safely parses point data, ensuring x, y are floats """
-    if p and isinstance(p, dict) and 'x' in p and 'y' in p:
-        try:
-            x_val = float(p['x'])
-            y_val = float(p['y'])
-            # Handle optional z and visibility, ensure they are floats if present
-            z_val = float(p['z']) if p.get('z') is not None else None
-            vis_val = float(p['visibility']) if p.get('visibility') is not None else None
-            # Create a new dict with ensured types, filtering out None visibility if needed by model
-            parsed = {'x': x_val, 'y': y_val, 'z': z_val}
-            if vis_val is not None:
-                 parsed['visibility'] = vis_val
-            return parsed
-        except (ValueError, TypeError):
-            # Handle cases where x or y cannot be converted to float
-            print(f"Warning: Could not parse point, invalid number format: {p}")
-            return None
-    return None
-
-def vec_subtract_2d(p1_data: Dict, p2_data: Dict) -> Optional[Dict[str, float]]:
-    """ Subtracts p2 from p1 (p1 - p2) safely for 2D vector """
-    p1 = parse_point(p1_data); p2 = parse_point(p2_data)
-    if p1 and p2:
-        return {"x": p1['x'] - p2['x'], "y": p1['y'] - p2['y']}
-    return None
-
-def vec_dot_2d(v1: Dict, v2: Dict) -> float:
-    """ Calculates dot product of two 2D vectors """
-    return v1.get('x', 0.0) * v2.get('x', 0.0) + v1.get('y', 0.0) * v2.get('y', 0.0)
-
-def vec_cross_2d(v1: Dict, v2: Dict) -> float:
-    """ Calculates the scalar value representing the Z-component of the 3D cross product (ax*by - ay*bx) """
-    return v1.get('x', 0.0) * v2.get('y', 0.0) - v1.get('y', 0.0) * v2.get('x', 0.0)
-
-def vec_magnitude_2d(v: Optional[Dict[str, float]]) -> float:
-    """ Calculates magnitude of a 2D vector """
-    if not v: return 0.0
-    mag_sq = v.get('x', 0.0)**2 + v.get('y', 0.0)**2
-    return math.sqrt(mag_sq) if mag_sq > 1e-12 else 0.0
-
-def angle_between_2d_vectors(v1_data: Dict, v2_data: Dict) -> float:
-    """ Calculate angle between two 2D vectors using dot product (0-180 degrees) """
-    v1 = v1_data # Assume already parsed dict
-    v2 = v2_data # Assume already parsed dict
-    if not v1 or not v2: return 0.0 # Check if vectors are valid dicts
-    mag1 = vec_magnitude_2d(v1); mag2 = vec_magnitude_2d(v2)
-    if mag1 * mag2 < 1e-12: return 0.0 # Avoid division by zero
-    dot = vec_dot_2d(v1, v2)
-    # Clamp rigorously before acos
-    cos_theta = max(-1.0, min(1.0, dot / (mag1 * mag2)))
-    # Check for potential NaN issues even after clamping due to float precision
-    if math.isnan(cos_theta): cos_theta = 1.0 if dot >= 0 else -1.0
-    try:
-        angle_rad = math.acos(cos_theta)
-        return math.degrees(angle_rad)
-    except ValueError as e:
-         print(f"Warning: Math domain error in acos({cos_theta}) for vectors {v1}, {v2}: {e}")
-         # Return 0 or 180 based on the sign of the clamped cosine
-         return 0.0 if cos_theta >= 0 else 180.0
-
-def angle_with_vertical(p1_data: Dict, p2_data: Dict, min_visibility: float = 0.5) -> float:
-    """ Calculates angle of vector p1->p2 with downward vertical (0-180 deg) """
-    p1 = parse_point(p1_data); p2 = parse_point(p2_data)
-    # Use .get with default for visibility check
-    if not p1 or not p2 or p1.get('visibility', 0.0) < min_visibility or p2.get('visibility', 0.0) < min_visibility:
-        return 0.0 # Default to 0 angle if points invalid or low visibility
-    vector = vec_subtract_2d(p2, p1)
-    if not vector: return 0.0
-    vertical = {"x": 0, "y": 1} # Y increases downwards
-    return angle_between_2d_vectors(vector, vertical)
-
-def calculate_angle(p1_data: Dict, p2_data: Dict, p3_data: Dict, min_visibility: float = 0.5) -> float:
-    """ Calculates the internal angle at p2 between vectors p2->p1 and p2->p3 (0-180 deg) """
-    p1 = parse_point(p1_data); p2 = parse_point(p2_data); p3 = parse_point(p3_data)
-    if not p1 or not p2 or not p3 or \
-       p1.get('visibility', 1.0) < min_visibility or \
-       p2.get('visibility', 1.0) < min_visibility or \
-       p3.get('visibility', 1.0) < min_visibility:
-        return 0.0 # Return 0 if points invalid or low visibility
-    v1 = vec_subtract_2d(p1, p2); v2 = vec_subtract_2d(p3, p2)
-    if not v1 or not v2: return 0.0
-    return angle_between_2d_vectors(v1, v2)
+# MediaPipe Pose landmark indices used by the evaluation
+NOSE = 0
+L_SHOULDER, R_SHOULDER = 11, 12
+L_ELBOW, R_ELBOW = 13, 14
+L_WRIST, R_WRIST = 15, 16
+L_HIP, R_HIP = 23, 24
+L_KNEE, R_KNEE = 25, 26
+L_ANKLE, R_ANKLE = 27, 28
+MAX_LM_INDEX = R_ANKLE # Landmarks must contain at least MAX_LM_INDEX + 1 points
+# Only these landmarks are read by the angle computation (face/hand points are never touched)
+_LM_USED = (NOSE, L_SHOULDER, R_SHOULDER, L_ELBOW, R_ELBOW, L_WRIST, R_WRIST, L_HIP, R_HIP, L_KNEE, R_KNEE, L_ANKLE, R_ANKLE)
+_LM_USED_IDX = np.array(_LM_USED)
+
+# Angle calculation constants (frozen into the JIT kernel as compile-time constants)
+_MIN_VIS: Final = 0.5 # Visibility threshold
+_EXT_X_THRESH: Final = 0.02 # Neck/Trunk extension: X-component threshold
+_CROSS_THRESH: Final = 1e-3 # Upper arm extension: cross product threshold (Tune this threshold)
+_EPS_SQ: Final = 1e-12 # Zero-length threshold for vectors and magnitude products
+
+# Per-thread landmark buffers reused across requests (thread-pool workers each get their own)
+_lm_buffers = threading.local()
+
+@dataclass
+class Landmarks:
+    """ Pose landmarks as contiguous arrays, filled once per request """
+    xy: np.ndarray # (N, 2) x/y coordinates
+    vis: np.ndarray # (N,) visibility, NaN where not provided
+
+    @classmethod
+    def from_models(cls, landmarks: List[Landmark]) -> 'Landmarks':
+        """ Copies only the used landmarks into this thread's buffers (valid until its next call); other rows stay (0, 0) with NaN visibility """
+        n = len(landmarks)
+        if n <= MAX_LM_INDEX: raise HTTPException(status_code=400, detail=f"Not enough landmarks ({n}). Need {MAX_LM_INDEX + 1}")
+        used = [landmarks[i] for i in _LM_USED]
+        xy = getattr(_lm_buffers, "xy", None)
+        if xy is None: # First request on this thread; rows past MAX_LM_INDEX are never read
+            xy = _lm_buffers.xy = np.zeros((MAX_LM_INDEX + 1, 2)); _lm_buffers.vis = np.full(MAX_LM_INDEX + 1, np.nan)
+        vis = _lm_buffers.vis
+        xy[_LM_USED_IDX] = [(p["x"], p["y"]) for p in used]
+        vis[_LM_USED_IDX] = [np.nan if (v := p.get("visibility")) is None else v for p in used]
+        return cls(xy=xy, vis=vis)
+
+    @classmethod
+    def batch_from_models(cls, frames: List[List[Landmark]]) -> 'Landmarks':
+        """ Stacks frames into (B, MAX_LM_INDEX + 1, 2) / (B, MAX_LM_INDEX + 1) arrays with the same row layout as from_models """
+        for i, frame in enumerate(frames):
+            if len(frame) <= MAX_LM_INDEX: raise HTTPException(status_code=400, detail=f"Frame {i}: Not enough landmarks ({len(frame)}). Need {MAX_LM_INDEX + 1}")
+        xy = np.zeros((len(frames), MAX_LM_INDEX + 1, 2)); vis = np.full((len(frames), MAX_LM_INDEX + 1), np.nan)
+        if frames:
+            used = [[frame[i] for i in _LM_USED] for frame in frames]
+            xy[:, _LM_USED_IDX] = [[(p["x"], p["y"]) for p in u] for u in used]
+            vis[:, _LM_USED_IDX] = [[np.nan if (v := p.get("visibility")) is None else v for p in u] for u in used]
+        return cls(xy=xy, vis=vis)
 
 # -----------------------------
-# 角度計算 (Pure 2D)
+# 2D Vector Calculation Helpers (NumPy, batched over rows; JIT-compiled when numba is available)
 # -----------------------------
-def compute_all_angles(landmarks: List[Landmark], filming_side: str) -> Dict[str, Any]:
-    """ Computes various joint angles and orientation flags from landmarks """
-    lm_indices = { "Nose": 0, "L_Shoulder": 11, "R_Shoulder": 12, "L_Elbow": 13, "R_Elbow": 14, "L_Wrist": 15, "R_Wrist": 16, "L_Hip": 23, "R_Hip": 24, "L_Knee": 25, "R_Knee": 26, "L_Ankle": 27, "R_Ankle": 28 }
-    max_index = max(lm_indices.values())
-    if len(landmarks) <= max_index: raise HTTPException(status_code=400, detail=f"Not enough landmarks ({len(landmarks)}). Need {max_index + 1}")
-
-    # Use model_dump() for Pydantic v2, dict() for v1 if needed for compatibility
-    lm = [lm.model_dump() if hasattr(lm, 'model_dump') else lm.dict() for lm in landmarks]
-    min_vis = 0.5 # Visibility threshold
-
-    # --- Midpoints (Ensure points are valid before averaging) ---
-    ls_p = parse_point(lm[lm_indices["L_Shoulder"]]); rs_p = parse_point(lm[lm_indices["R_Shoulder"]])
-    lh_p = parse_point(lm[lm_indices["L_Hip"]]); rh_p = parse_point(lm[lm_indices["R_Hip"]])
-    nose_p = parse_point(lm[lm_indices["Nose"]])
-
-    shoulder_mid = {"x": (ls_p['x'] + rs_p['x']) / 2, "y": (ls_p['y'] + rs_p['y']) / 2, "visibility": min(ls_p.get('visibility',0), rs_p.get('visibility',0))} if ls_p and rs_p and ls_p.get('visibility',0)>min_vis and rs_p.get('visibility',0)>min_vis else None
-    hip_mid = {"x": (lh_p['x'] + rh_p['x']) / 2, "y": (lh_p['y'] + rh_p['y']) / 2, "visibility": min(lh_p.get('visibility',0), rh_p.get('visibility',0))} if lh_p and rh_p and lh_p.get('visibility',0)>min_vis and rh_p.get('visibility',0)>min_vis else None
-
-    if not shoulder_mid or not hip_mid:
-         print("Warning: Could not compute reliable midpoints (shoulder/hip). Using defaults.")
-         # Provide default coordinates if midpoints cannot be calculated
-         shoulder_mid = shoulder_mid or {"x": 0.5, "y": 0.2, "visibility": 0.0}
-         hip_mid = hip_mid or {"x": 0.5, "y": 0.5, "visibility": 0.0}
-         # Raise error if midpoints are essential and cannot be estimated
-         # raise HTTPException(status_code=400, detail="Cannot compute midpoints (shoulder/hip).")
-
-    # --- Helper: Extension Flag from Vertical + X-Component ---
-    def get_extension_flag_from_vertical(p1: Optional[Dict], p2: Optional[Dict], side: str, angle_mag_vert: float) -> bool:
-        is_ext = False
-        p1_p = parse_point(p1); p2_p = parse_point(p2)
-        if not p1_p or not p2_p or p1_p.get('visibility', 0.0) < min_vis or p2_p.get('visibility', 0.0) < min_vis: return False
-        vector_x = p2_p['x'] - p1_p['x']
-        x_threshold = 0.02
-        if angle_mag_vert > 5:
-            if side == "left": is_ext = vector_x > x_threshold
-            elif side == "right": is_ext = vector_x < -x_threshold
-        return is_ext
-
-    # --- Neck ---
-    neckAngleMagnitude = angle_with_vertical(shoulder_mid, nose_p) if nose_p else 0.0
-    neckIsExtension = get_extension_flag_from_vertical(shoulder_mid, nose_p, filming_side, neckAngleMagnitude)
-
-    # --- Trunk ---
-    trunkAngleMagnitude = angle_with_vertical(hip_mid, shoulder_mid)
-    trunkIsExtension = get_extension_flag_from_vertical(hip_mid, shoulder_mid, filming_side, trunkAngleMagnitude)
-    # --- Trunk Rotation (Approximate) ---
-    trunkRotationAngle = 0.0
-    if ls_p and rs_p and lh_p and rh_p:
-        shoulder_dx = rs_p['x'] - ls_p['x']; shoulder_dy = rs_p['y'] - ls_p['y']
-        hip_dx = rh_p['x'] - lh_p['x']; hip_dy = rh_p['y'] - lh_p['y']
-        shoulder_angle_rad = math.atan2(shoulder_dy, shoulder_dx) if shoulder_dx != 0 or shoulder_dy != 0 else 0
-        hip_angle_rad = math.atan2(hip_dy, hip_dx) if hip_dx != 0 or hip_dy != 0 else 0
-        trunkRotationAngle = math.degrees(shoulder_angle_rad - hip_angle_rad)
-        trunkRotationAngle = (trunkRotationAngle + 180) % 360 - 180
-
-    # --- Process Limbs ---
-    results = {}
-    for side in ["left", "right"]:
-        prefix = "L_" if side == "left" else "R_"
-        hip_p = parse_point(lm[lm_indices[prefix + "Hip"]])
-        shoulder_p = parse_point(lm[lm_indices[prefix + "Shoulder"]])
-        elbow_p = parse_point(lm[lm_indices[prefix + "Elbow"]])
-        wrist_p = parse_point(lm[lm_indices[prefix + "Wrist"]])
-        knee_p = parse_point(lm[lm_indices[prefix + "Knee"]])
-        ankle_p = parse_point(lm[lm_indices[prefix + "Ankle"]])
-
-        # Upper Arm
-        ua_angle_mag_rel_trunk = 0.0
-        ua_is_ext = False
-        if shoulder_p and hip_p and elbow_p and shoulder_p.get('visibility',0) > min_vis and hip_p.get('visibility',0) > min_vis and elbow_p.get('visibility',0) > min_vis:
-            trunk_vec_T_2d = vec_subtract_2d(shoulder_p, hip_p)
-            upper_arm_vec_UA_2d = vec_subtract_2d(elbow_p, shoulder_p)
-            if trunk_vec_T_2d and upper_arm_vec_UA_2d:
-                ua_angle_mag_rel_trunk = angle_between_2d_vectors(trunk_vec_T_2d, upper_arm_vec_UA_2d)
-                cross_product_z = vec_cross_2d(trunk_vec_T_2d, upper_arm_vec_UA_2d)
-                cross_threshold = 0.001 # Tune this threshold
-                if ua_angle_mag_rel_trunk > 10:
-                    if filming_side == "left": ua_is_ext = cross_product_z > cross_threshold
-                    elif filming_side == "right": ua_is_ext = cross_product_z < -cross_threshold
-        results[f"{side}UpperArmAngleMagnitude"] = ua_angle_mag_rel_trunk
-        results[f"{side}UpperArmIsExtension"] = ua_is_ext
-
-        # Elbow
-        results[f"{side}ElbowAngle"] = calculate_angle(shoulder_p, elbow_p, wrist_p)
-
-        # Wrist
-        results[f"{side}WristAngle"] = 0.0 # Keep as unreliable
-
-        # Knee
-        results[f"{side}KneeAngle"] = calculate_angle(hip_p, knee_p, ankle_p)
-
-    # Combine results
-    final_angles = {
-        "neckAngleMagnitude": neckAngleMagnitude, "neckIsExtension": neckIsExtension,
-        "trunkAngleMagnitude": trunkAngleMagnitude, "trunkIsExtension": trunkIsExtension,
-        "trunkRotationAngle": trunkRotationAngle,
-        **results
-    }
-    return final_angles
+@njit(cache=True)
+def vec_subtract_2d(xy: np.ndarray, head: Any, tail: Any) -> np.ndarray:
+    """ Vectors tail->head (xy[head] - xy[tail]) for landmark indices or index arrays """
+    return xy[head] - xy[tail]
+
+@njit(cache=True)
+def vec_cross_2d(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
+    """ Z-component of the 3D cross product (ax*by - ay*bx) for paired (K, 2) vectors """
+    return v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0]
+
+@njit(cache=True)
+def angle_between_2d_vectors(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
+    """ Calculates angles between paired (K, 2) vectors using dot product (0-180 degrees) """
+    dot = v1[:, 0] * v2[:, 0] + v1[:, 1] * v2[:, 1]
+    mag_sq1 = v1[:, 0] * v1[:, 0] + v1[:, 1] * v1[:, 1]; mag_sq2 = v2[:, 0] * v2[:, 0] + v2[:, 1] * v2[:, 1]
+    # Vectors with |v|^2 <= _EPS_SQ count as zero length
+    mag = np.where(mag_sq1 > _EPS_SQ, np.sqrt(mag_sq1), 0.0) * np.where(mag_sq2 > _EPS_SQ, np.sqrt(mag_sq2), 0.0)
+    valid = (mag >= _EPS_SQ) & (mag < np.inf) # Avoid division by zero / overflow (|v|^2 > 1.8e308); such angles are reported as 0
+    cos_theta = np.clip(dot / np.where(valid, mag, 1.0), -1.0, 1.0)
+    return np.where(valid, np.degrees(np.arccos(cos_theta)), 0.0)
+
+@njit(cache=True)
+def angle_with_vertical_2d(v: np.ndarray) -> np.ndarray:
+    """ Angles of (K, 2) vectors from the downward vertical (Y increases downwards), 0-180 degrees """
+    mag_sq = v[:, 0] * v[:, 0] + v[:, 1] * v[:, 1]
+    # Reference is the unit vector (0, 1): the angle is atan2(|x|, y); zero-length vectors report 0
+    return np.where(mag_sq > _EPS_SQ, np.degrees(np.arctan2(np.abs(v[:, 0]), v[:, 1])), 0.0)
 
 # -----------------------------
-# Revised Scoring Functions
+# 角度計算 (Pure 2D, vectorized)
 # -----------------------------
-def calc_neck_score_revised(angle_magnitude: float, is_extension: bool, rotationFlag: bool, sideBendFlag: bool) -> int:
-    base = 1
-    if angle_magnitude > 5 and is_extension: base = 2
-    elif not is_extension and angle_magnitude > 20: base = 2
-    add = (1 if rotationFlag else 0) + (1 if sideBendFlag else 0)
-    return base + add
-
-def calc_trunk_score_revised(angle_magnitude: float, is_extension: bool, rotationFlag: bool, sideBendFlag: bool) -> int:
-    base = 1
-    if angle_magnitude > 5:
-        if is_extension: base = 2 if angle_magnitude <= 20 else 3
-        else: # Flexion
-            if angle_magnitude <= 20: base = 2
-            elif angle_magnitude <= 60: base = 3
-            else: base = 4
-    add = (1 if rotationFlag else 0) + (1 if sideBendFlag else 0)
-    return base + add
-
-def calc_upper_arm_score_revised(angle_relative_to_trunk: float, is_extension: bool, upperArmCorrection: float, shoulderElevation: float, gravityAssist: float) -> int:
-    base = 1
-    angle = angle_relative_to_trunk
-    if is_extension: base = 2 if angle <= 20 else 3
-    else: # Flexion or neutral
-        if angle <= 20: base = 1
-        elif angle <= 45: base = 2
-        elif angle <= 90: base = 3
-        else: base = 4
-    corrected = base + int(upperArmCorrection) + int(shoulderElevation) + int(gravityAssist)
-    return max(1, min(6, corrected))
+# Layout of the array returned by _compute_angles_nb
+# [0-7]: neck, trunk, L/R upper arm, L/R elbow, L/R knee angles
+# [8-11]: neck, trunk, L/R upper arm extension flags (1.0 / 0.0)
+# [12]: trunk rotation angle, [13]: 1.0 if both shoulder/hip midpoints were reliable
+@njit(cache=True, nogil=True) # Releases the GIL so thread-pool workers can run it in parallel
+def _compute_angles_nb(xy: np.ndarray, vis: np.ndarray, side: int) -> np.ndarray:
+    """ Numeric core of compute_angle_array (side: 0 = left, 1 = right) """
+    nose, ls, rs, le, re, lw, rw = NOSE, L_SHOULDER, R_SHOULDER, L_ELBOW, R_ELBOW, L_WRIST, R_WRIST
+    lh, rh, lk, rk, la, ra = L_HIP, R_HIP, L_KNEE, R_KNEE, L_ANKLE, R_ANKLE
+    min_vis = _MIN_VIS
+    # Missing visibility is NaN: it fails the ">"/">=" gates (treated as 0.0)
+    # and passes the "not <" gate used by joint angles (treated as 1.0).
+
+    # --- Midpoints (Both points must be visible) ---
+    shoulder_ok = vis[ls] > min_vis and vis[rs] > min_vis
+    hip_ok = vis[lh] > min_vis and vis[rh] > min_vis
+    # Default coordinates if midpoints cannot be calculated (angles against them are then 0)
+    shoulder_mid = (xy[ls] + xy[rs]) * 0.5 if shoulder_ok else np.array([0.5, 0.2])
+    hip_mid = (xy[lh] + xy[rh]) * 0.5 if hip_ok else np.array([0.5, 0.5])
+
+    # --- All angles in one batch ---
+    # Rows 0-1: neck (shoulder_mid -> nose) and trunk (hip_mid -> shoulder_mid) against downward vertical (Y increases downwards)
+    # Rows 2-3: L/R upper arm (trunk vector hip->shoulder vs. upper arm vector shoulder->elbow)
+    # Rows 4-7: L/R elbow (shoulder-elbow-wrist) and L/R knee (hip-knee-ankle) internal angles
+    v1_head = np.array([ls, rs, ls, rs, lh, rh]); v1_tail = np.array([lh, rh, le, re, lk, rk])
+    v2_head = np.array([le, re, lw, rw, la, ra]); v2_tail = np.array([ls, rs, le, re, lk, rk])
+    v1 = np.empty((8, 2))
+    v1[0] = xy[nose] - shoulder_mid; v1[1] = shoulder_mid - hip_mid
+    v1[2:] = vec_subtract_2d(xy, v1_head, v1_tail); v2 = vec_subtract_2d(xy, v2_head, v2_tail) # v2 pairs with rows 2-7
+
+    # Visibility gates per row
+    ok = np.empty(8, dtype=np.bool_)
+    ok[0] = shoulder_ok and vis[nose] >= min_vis
+    ok[1] = shoulder_ok and hip_ok
+    ok[2:4] = (vis[v1_head[:2]] > min_vis) & (vis[v1_tail[:2]] > min_vis) & (vis[v2_head[:2]] > min_vis)
+    ok[4:] = ~((vis[v1_head[2:]] < min_vis) | (vis[v1_tail[2:]] < min_vis) | (vis[v2_head[2:]] < min_vis))
+
+    out = np.zeros(14)
+    angles = np.empty(8)
+    angles[:2] = angle_with_vertical_2d(v1[:2]); angles[2:] = angle_between_2d_vectors(v1[2:], v2)
+    angles = np.where(ok & np.isfinite(angles), angles, 0.0) # Non-finite angles (overflowing coordinates) fail like any other check
+    out[:8] = angles
+
+    # --- Extension Flags ---
+    # Neck/Trunk: X-component of the vertical-angle vector; Upper arm: sign of trunk x upper-arm cross product
+    # Mirrored by the filming side sign (negation is exact, so "x * -1 > t" equals "x < -t")
+    sign = 1.0 if side == 0 else -1.0
+    cross_product_z = vec_cross_2d(v1[2:4], v2[:2])
+    out[8:10] = np.where((v1[:2, 0] * sign > _EXT_X_THRESH) & (angles[:2] > 5), 1.0, 0.0)
+    out[10:12] = np.where((cross_product_z * sign > _CROSS_THRESH) & (angles[2:4] > 10), 1.0, 0.0)
+
+    # --- Trunk Rotation (Approximate) ---
+    shoulder_dx = xy[rs, 0] - xy[ls, 0]; shoulder_dy = xy[rs, 1] - xy[ls, 1]
+    hip_dx = xy[rh, 0] - xy[lh, 0]; hip_dy = xy[rh, 1] - xy[lh, 1]
+    shoulder_angle_rad = math.atan2(shoulder_dy, shoulder_dx) if shoulder_dx != 0 or shoulder_dy != 0 else 0.0
+    hip_angle_rad = math.atan2(hip_dy, hip_dx) if hip_dx != 0 or hip_dy != 0 else 0.0
+    trunkRotationAngle = math.degrees(shoulder_angle_rad - hip_angle_rad)
+    out[12] = (trunkRotationAngle + 180) % 360 - 180
+    out[13] = 1.0 if shoulder_ok and hip_ok else 0.0
+    return out
+
+@njit(cache=True, nogil=True)
+def _compute_angles_batch_nb(xy: np.ndarray, vis: np.ndarray, side: int) -> np.ndarray:
+    """ _compute_angles_nb over a (B, N, 2) / (B, N) batch; one row per frame """
+    out = np.empty((xy.shape[0], 14))
+    for b in range(xy.shape[0]): out[b] = _compute_angles_nb(xy[b], vis[b], side)
+    return out
+
+def compute_angle_array(lms: Landmarks, filming_side: str) -> np.ndarray:
+    """ Runs the angle kernel; see the layout above """
+    # Filming side is passed as an int (0 = left, 1 = right) for the compiled kernel
+    out = _compute_angles_nb(lms.xy, lms.vis, 0 if filming_side == "left" else 1)
+    if not out[13]:
+         logger.warning("Could not compute reliable midpoints (shoulder/hip). Using defaults.")
+    return out
+
+# Response keys for angles_to_dict, in response order: (key, kernel output index, is a flag)
+_ANGLE_FIELDS = (
+    ("neckAngleMagnitude", 0, False), ("neckIsExtension", 8, True),
+    ("trunkAngleMagnitude", 1, False), ("trunkIsExtension", 9, True),
+    ("trunkRotationAngle", 12, False),
+    ("leftUpperArmAngleMagnitude", 2, False), ("leftUpperArmIsExtension", 10, True),
+    ("leftElbowAngle", 4, False), ("leftWristAngle", -1, False), ("leftKneeAngle", 6, False),
+    ("rightUpperArmAngleMagnitude", 3, False), ("rightUpperArmIsExtension", 11, True),
+    ("rightElbowAngle", 5, False), ("rightWristAngle", -1, False), ("rightKneeAngle", 7, False),
+)
 
+def angles_to_dict(out: List[float]) -> Dict[str, Any]:
+    """ Names the kernel outputs (plain Python floats/bools for the JSON response) """
+    # Wrist angles are not measured (index -1): kept as unreliable 0.0
+    return {key: (out[i] > 0 if flag else out[i]) if i >= 0 else 0.0 for key, i, flag in _ANGLE_FIELDS}
+
+# -----------------------------
+# Revised Scoring Functions (JIT-compiled and called from _compute_scores_nb when numba is available)
+# -----------------------------
+# Angle brackets: scores[searchsorted(bounds, angle)] (side="left", so each bound is inclusive of the lower bracket)
+# Indexed by is_extension: (flexion, extension)
+_NECK_BOUNDS = (np.array([20.0]), np.array([5.0])); _NECK_SCORES = (np.array([1, 2]), np.array([1, 2]))
+_TRUNK_BOUNDS = (np.array([5.0, 20.0, 60.0]), np.array([5.0, 20.0])); _TRUNK_SCORES = (np.array([1, 2, 3, 4]), np.array([1, 2, 3]))
+_UPPER_ARM_BOUNDS = (np.array([20.0, 45.0, 90.0]), np.array([20.0])); _UPPER_ARM_SCORES = (np.array([1, 2, 3, 4]), np.array([2, 3]))
+# Lower bounds inclusive of the upper bracket (30 <= flex, 80 <= elbow) are shifted down by one ulp
+_LEG_FLEX_BOUNDS = np.array([np.nextafter(30.0, -np.inf), 60.0]); _LEG_FLEX_ADD = np.array([0, 1, 2])
+_FOREARM_BOUNDS = np.array([np.nextafter(80.0, -np.inf), 120.0]); _FOREARM_SCORES = np.array([2, 1, 2])
+
+@njit(cache=True)
+def _bracket(bounds: np.ndarray, scores: np.ndarray, angle: float) -> int:
+    """ Score of the bracket the angle falls into """
+    return int(scores[np.searchsorted(bounds, angle)])
+
+@njit(cache=True)
+def calc_neck_score_revised(angle_magnitude: float, is_extension: bool, add: int) -> int:
+    """ add: twist + side-bend adjustment (0-2) """
+    ext = 1 if is_extension else 0
+    return _bracket(_NECK_BOUNDS[ext], _NECK_SCORES[ext], angle_magnitude) + add
+
+@njit(cache=True)
+def calc_trunk_score_revised(angle_magnitude: float, is_extension: bool, add: int) -> int:
+    """ add: twist + side-bend adjustment (0-2) """
+    ext = 1 if is_extension else 0
+    return _bracket(_TRUNK_BOUNDS[ext], _TRUNK_SCORES[ext], angle_magnitude) + add
+
+@njit(cache=True)
+def calc_upper_arm_score_revised(angle_relative_to_trunk: float, is_extension: bool, corr_sum: int) -> int:
+    """ corr_sum: abduction/rotation + shoulder elevation + gravity assist (-1 to 2) """
+    ext = 1 if is_extension else 0
+    base = _bracket(_UPPER_ARM_BOUNDS[ext], _UPPER_ARM_SCORES[ext], angle_relative_to_trunk)
+    return max(1, min(6, base + corr_sum))
+
+@njit(cache=True)
 def calc_leg_score_unified(postureCategory: str, kneeFlexAngle: Optional[float]) -> int:
     if postureCategory == "sittingWalking": return 1
     base = 1 if postureCategory == "standingBoth" else 2
     internal_angle = 180.0 if kneeFlexAngle is None else kneeFlexAngle
-    flex = 180.0 - internal_angle
-    add = 0
-    if 30 <= flex <= 60: add = 1
-    elif flex > 60: add = 2
-    return base + add
+    return base + _bracket(_LEG_FLEX_BOUNDS, _LEG_FLEX_ADD, 180.0 - internal_angle)
 
+@njit(cache=True)
 def calc_forearm_score(elbowAngle: Optional[float]) -> int:
     internal_angle = 90.0 if elbowAngle is None else elbowAngle
-    return 1 if 80 <= internal_angle <= 120 else 2 # Corrected range
+    return _bracket(_FOREARM_BOUNDS, _FOREARM_SCORES, internal_angle) # 80-120 -> 1
 
+# Precomputed (already clamped) correction tables
+WRIST_LUT = np.array([[1, 2], [2, 3]], dtype=np.int8) # [base score (1-2) - 1, deviation/twist flag]: clamp 1-3
+LOAD_LUT = np.array([[0, 1, 2], [1, 2, 3]], dtype=np.int8) # [shock flag, load bucket (<5, 5-10, >10 kg)]: clamp 0-3
+
+@njit(cache=True)
 def calc_wrist_score(base_score_from_input: int, wristCorrectionFlag: float) -> int:
-    base = base_score_from_input
-    score = base + int(wristCorrectionFlag)
-    return max(1, min(3, score))
+    return int(WRIST_LUT[base_score_from_input - 1, int(wristCorrectionFlag)])
 
+@njit(cache=True)
 def calc_load_score(loadKgInput: float, shockForceFlag: int) -> int: # Added shockForceFlag
-    base_score = 0
-    if loadKgInput < 5: base_score = 0
-    elif loadKgInput <= 10: base_score = 1
-    else: base_score = 2
-    final_load_score = base_score + int(shockForceFlag)
-    return max(0, min(3, final_load_score))
+    bucket = int(not loadKgInput < 5) + int(not loadKgInput <= 10) # <5 / 5-10 / >10 (NaN falls in >10 as before)
+    return int(LOAD_LUT[int(shockForceFlag), bucket])
 
 # -----------------------------
 # Lookups & Helpers
 # -----------------------------
-tableA_Lookup = { "1,1,1":1, "1,1,2":2, "1,1,3":3, "1,1,4":4, "1,2,1":1, "1,2,2":2, "1,2,3":3, "1,2,4":4, "1,3,1":3, "1,3,2":3, "1,3,3":5, "1,3,4":6, "1,4,1":4,"1,4,2":4,"1,4,3":6,"1,4,4":7, "2,1,1":2, "2,1,2":3, "2,1,3":4, "2,1,4":5, "2,2,1":3, "2,2,2":4, "2,2,3":5, "2,2,4":6, "2,3,1":4, "2,3,2":5, "2,3,3":6, "2,3,4":7, "2,4,1":5,"2,4,2":6,"2,4,3":7,"2,4,4":8, "3,1,1":2, "3,1,2":4, "3,1,3":5, "3,1,4":6, "3,2,1":4, "3,2,2":5, "3,2,3":6, "3,2,4":7, "3,3,1":5, "3,3,2":6, "3,3,3":7, "3,3,4":8, "3,4,1":6,"3,4,2":7,"3,4,3":8,"3,4,4":9, "4,1,1":3, "4,1,2":5, "4,1,3":6, "4,1,4":7, "4,2,1":5, "4,2,2":6, "4,2,3":7, "4,2,4":8, "4,3,1":6, "4,3,2":7, "4,3,3":8, "4,3,4":9, "4,4,1":7,"4,4,2":8,"4,4,3":9,"4,4,4":9, "5,1,1":4,"5,1,2":6,"5,1,3":7,"5,1,4":8,"5,2,1":6,"5,2,2":7,"5,2,3":8,"5,2,4":9,"5,3,1":7,"5,3,2":8,"5,3,3":9,"5,3,4":9,"5,4,1":8,"5,4,2":9,"5,4,3":9,"5,4,4":9, "6,1,1":5,"6,1,2":7,"6,1,3":8,"6,1,4":9,"6,2,1":7,"6,2,2":8,"6,2,3":9,"6,2,4":9,"6,3,1":8,"6,3,2":9,"6,3,3":9,"6,3,4":9,"6,4,1":9,"6,4,2":9,"6,4,3":9,"6,4,4":9 }
-tableB_Lookup = { "1,1,1":1,"1,1,2":1,"1,1,3":2,"1,2,1":2,"1,2,2":2,"1,2,3":3,"2,1,1":2,"2,1,2":3,"2,1,3":3,"2,2,1":3,"2,2,2":4,"2,2,3":5,"3,1,1":3,"3,1,2":4,"3,1,3":4,"3,2,1":4,"3,2,2":5,"3,2,3":6,"4,1,1":4,"4,1,2":5,"4,1,3":5,"4,2,1":5,"4,2,2":6,"4,2,3":7,"5,1,1":5,"5,1,2":6,"5,1,3":6,"5,2,1":6,"5,2,2":7,"5,2,3":8,"6,1,1":6,"6,1,2":7,"6,1,3":7,"6,2,1":7,"6,2,2":8,"6,2,3":9 }
-tableC_Lookup = { "1,1":1,"1,2":1,"1,3":1,"1,4":2,"1,5":3,"1,6":3,"1,7":4,"1,8":5,"1,9":6,"1,10":7,"1,11":7,"1,12":7,"2,1":1,"2,2":2,"2,3":2,"2,4":3,"2,5":4,"2,6":4,"2,7":5,"2,8":6,"2,9":6,"2,10":7,"2,11":7,"2,12":8,"3,1":2,"3,2":3,"3,3":3,"3,4":4,"3,5":5,"3,6":6,"3,7":7,"3,8":7,"3,9":7,"3,10":8,"3,11":8,"3,12":8,"4,1":3,"4,2":4,"4,3":4,"4,4":4,"4,5":5,"4,6":6,"4,7":7,"4,8":8,"4,9":8,"4,10":9,"4,11":9,"4,12":9,"5,1":4,"5,2":4,"5,3":4,"5,4":5,"5,5":6,"5,6":7,"5,7":8,"5,8":8,"5,9":9,"5,10":9,"5,11":9,"5,12":9,"6,1":6,"6,2":6,"6,3":6,"6,4":7,"6,5":8,"6,6":8,"6,7":9,"6,8":9,"6,9":10,"6,10":10,"6,11":10,"6,12":10,"7,1":7,"7,2":7,"7,3":7,"7,4":8,"7,5":9,"7,6":9,"7,7":9,"7,8":10,"7,9":10,"7,10":11,"7,11":11,"7,12":11,"8,1":8,"8,2":8,"8,3":8,"8,4":9,"8,5":10,"8,6":10,"8,7":10,"8,8":10,"8,9":11,"8,10":11,"8,11":11,"8,12":12,"9,1":9,"9,2":9,"9,3":9,"9,4":10,"9,5":10,"9,6":11,"9,7":11,"9,8":11,"9,9":12,"9,10":12,"9,11":12,"9,12":12,"10,1":10,"10,2":10,"10,3":10,"10,4":11,"10,5":11,"10,6":11,"10,7":12,"10,8":12,"10,9":12,"10,10":12,"10,11":12,"10,12":12,"11,1":11,"11,2":11,"11,3":11,"11,4":12,"11,5":12,"11,6":12,"11,7":12,"11,8":12,"11,9":12,"11,10":12,"11,11":12,"11,12":12,"12,1":12,"12,2":12,"12,3":12,"12,4":12,"12,5":12,"12,6":12,"12,7":12,"12,8":12,"12,9":12,"12,10":12,"12,11":12,"12,12":12 }
-
-def lookup_score(table: Dict[str, int], key_parts: List[int], min_vals: List[int], max_vals: List[int]) -> int:
-    clamped_keys = [max(min_v, min(max_v, int(round(k)))) for k, min_v, max_v in zip(key_parts, min_vals, max_vals)]
-    key = ",".join(map(str, clamped_keys))
-    val = table.get(key)
-    if val is None:
-        print(f"Warning: Lookup key '{key}' not found in table. Returning default 1.")
-        return 1
-    return val
-
-def getScoreA(trunk: int, neck: int, leg: int, loadKgInput: float, shockForceFlag: int) -> int:
-    table_a_score = lookup_score(tableA_Lookup, [trunk, neck, leg], [1, 1, 1], [6, 4, 4])
-    final_load_score = calc_load_score(loadKgInput, shockForceFlag)
-    return table_a_score + final_load_score
-
-def getScoreB(upperArm: int, forearm: int, wrist: int, coupling: int) -> int:
-    base_score = lookup_score(tableB_Lookup, [upperArm, forearm, wrist], [1, 1, 1], [6, 2, 3])
-    return base_score + coupling
-
-def getTableCScore(scoreA: int, scoreB: int) -> int:
-    return lookup_score(tableC_Lookup, [scoreA, scoreB], [1, 1], [12, 12])
+# Dense REBA tables (int8), indexed by 0-based scores: TABLE_A[trunk-1, neck-1, leg-1] etc.
+TABLE_A = np.array([
+    [[1, 2, 3, 4], [1, 2, 3, 4], [3, 3, 5, 6], [4, 4, 6, 7]], # Trunk 1
+    [[2, 3, 4, 5], [3, 4, 5, 6], [4, 5, 6, 7], [5, 6, 7, 8]], # Trunk 2
+    [[2, 4, 5, 6], [4, 5, 6, 7], [5, 6, 7, 8], [6, 7, 8, 9]], # Trunk 3
+    [[3, 5, 6, 7], [5, 6, 7, 8], [6, 7, 8, 9], [7, 8, 9, 9]], # Trunk 4
+    [[4, 6, 7, 8], [6, 7, 8, 9], [7, 8, 9, 9], [8, 9, 9, 9]], # Trunk 5
+    [[5, 7, 8, 9], [7, 8, 9, 9], [8, 9, 9, 9], [9, 9, 9, 9]], # Trunk 6
+], dtype=np.int8) # (6, 4, 4): Trunk x Neck x Legs
+TABLE_B = np.array([
+    [[1, 1, 2], [2, 2, 3]], # Upper Arm 1
+    [[2, 3, 3], [3, 4, 5]], # Upper Arm 2
+    [[3, 4, 4], [4, 5, 6]], # Upper Arm 3
+    [[4, 5, 5], [5, 6, 7]], # Upper Arm 4
+    [[5, 6, 6], [6, 7, 8]], # Upper Arm 5
+    [[6, 7, 7], [7, 8, 9]], # Upper Arm 6
+], dtype=np.int8) # (6, 2, 3): Upper Arm x Forearm x Wrist
+TABLE_C = np.array([
+    [ 1,  1,  1,  2,  3,  3,  4,  5,  6,  7,  7,  7], # Score A 1
+    [ 1,  2,  2,  3,  4,  4,  5,  6,  6,  7,  7,  8], # Score A 2
+    [ 2,  3,  3,  4,  5,  6,  7,  7,  7,  8,  8,  8], # Score A 3
+    [ 3,  4,  4,  4,  5,  6,  7,  8,  8,  9,  9,  9], # Score A 4
+    [ 4,  4,  4,  5,  6,  7,  8,  8,  9,  9,  9,  9], # Score A 5
+    [ 6,  6,  6,  7,  8,  8,  9,  9, 10, 10, 10, 10], # Score A 6
+    [ 7,  7,  7,  8,  9,  9,  9, 10, 10, 11, 11, 11], # Score A 7
+    [ 8,  8,  8,  9, 10, 10, 10, 10, 11, 11, 11, 12], # Score A 8
+    [ 9,  9,  9, 10, 10, 11, 11, 11, 12, 12, 12, 12], # Score A 9
+    [10, 10, 10, 11, 11, 11, 12, 12, 12, 12, 12, 12], # Score A 10
+    [11, 11, 11, 12, 12, 12, 12, 12, 12, 12, 12, 12], # Score A 11
+    [12, 12, 12, 12, 12, 12, 12, 12, 12, 12, 12, 12], # Score A 12
+], dtype=np.int8) # (12, 12): Score A x Score B
+
+# Layout of the int array returned by _compute_scores_nb: the intermediate scores in _SCORE_KEYS order, then the final score
+_SCORE_KEYS = ("neck", "trunk", "leg", "upperArm", "forearm", "wrist", "scoreA", "scoreB", "tableC", "activity")
+# Layout of the calibration array passed to _compute_scores_nb
+_CALIB_FIELDS = ("neckRotation", "neckLateralBending", "trunkLateralFlexion", "loadForce", "shockForce",
+                 "upperArmCorrection", "shoulderElevation", "gravityAssist", "wristBaseScore", "wristCorrection",
+                 "coupling", "staticPosture", "repetitiveMovement", "unstableMovement")
+
+@njit(cache=True, nogil=True)
+def _compute_scores_nb(angles: np.ndarray, side: int, posture: str, supporting_leg: str, calib: np.ndarray) -> np.ndarray:
+    """ Component, table, activity and final scores from the _compute_angles_nb output (side: 0 = left, 1 = right; supporting_leg: "" if unset) """
+    # --- Calibration adjustments, each built once (twist: calibration flag for the neck, measured rotation for the trunk) ---
+    neck_add = int(calib[0] > 0) + int(calib[1] > 0)
+    trunk_add = int(abs(angles[12]) >= 5) + int(calib[2] > 0)
+    upper_arm_add = int(calib[5]) + int(calib[6]) + int(calib[7])
+
+    # --- Neck / Trunk ---
+    neck = calc_neck_score_revised(angles[0], angles[8] > 0, neck_add)
+    trunk = calc_trunk_score_revised(angles[1], angles[9] > 0, trunk_add)
+
+    # --- Leg Score ---
+    left_knee_angle = angles[6]; right_knee_angle = angles[7]
+    if posture == "standingOne" and supporting_leg == "left": leg = calc_leg_score_unified(posture, left_knee_angle)
+    elif posture == "standingOne" and supporting_leg == "right": leg = calc_leg_score_unified(posture, right_knee_angle)
+    else: leg = max(calc_leg_score_unified(posture, left_knee_angle), calc_leg_score_unified(posture, right_knee_angle)) # sittingWalking is always 1
+
+    # --- Limb Scores (filming side) ---
+    upper_arm = calc_upper_arm_score_revised(angles[2 + side], angles[10 + side] > 0, upper_arm_add)
+    forearm = calc_forearm_score(angles[4 + side])
+    wrist = calc_wrist_score(int(calib[8]), calib[9])
+
+    # --- Combine Scores: Table A + load, Table B + coupling, then Table C (indices clamped to each table) ---
+    score_a = int(TABLE_A[min(max(trunk, 1), 6) - 1, min(max(neck, 1), 4) - 1, min(max(leg, 1), 4) - 1]) + calc_load_score(calib[3], calib[4])
+    score_b = int(TABLE_B[min(max(upper_arm, 1), 6) - 1, min(max(forearm, 1), 2) - 1, min(max(wrist, 1), 3) - 1]) + int(calib[10])
+    table_c = int(TABLE_C[min(max(score_a, 1), 12) - 1, min(max(score_b, 1), 12) - 1])
+    activity = int(calib[11]) + int(calib[12]) + int(calib[13])
+
+    out = np.empty(11, dtype=np.int64)
+    out[0] = neck; out[1] = trunk; out[2] = leg; out[3] = upper_arm; out[4] = forearm; out[5] = wrist
+    out[6] = score_a; out[7] = score_b; out[8] = table_c; out[9] = activity
+    out[10] = max(1, min(15, table_c + activity)) # Clamp 1-15
+    return out
+
+# Risk level by final score (index 0 unused): 1 / 2-3 / 4-7 / 8-10 / 11-15
+_RISK = (None, "無視できる (Negligible)",
+         "低リスク (Low)", "低リスク (Low)",
+         "中リスク (Medium)", "中リスク (Medium)", "中リスク (Medium)", "中リスク (Medium)",
+         "高リスク (High)", "高リスク (High)", "高リスク (High)",
+         "非常に高リスク (Very High)", "非常に高リスク (Very High)", "非常に高リスク (Very High)", "非常に高リスク (Very High)", "非常に高リスク (Very High)")
+
+@njit(cache=True, nogil=True)
+def _compute_scores_batch_nb(angles: np.ndarray, side: int, posture: str, supporting_leg: str, calib: np.ndarray) -> np.ndarray:
+    """ _compute_scores_nb for every row of a (B, 14) angle batch """
+    out = np.empty((angles.shape[0], 11), dtype=np.int64)
+    for b in range(angles.shape[0]): out[b] = _compute_scores_nb(angles[b], side, posture, supporting_leg, calib)
+    return out
 
 def get_risk_level(score: int) -> str:
-    if score == 1: return "無視できる (Negligible)"
-    elif 2 <= score <= 3: return "低リスク (Low)"
-    elif 4 <= score <= 7: return "中リスク (Medium)"
-    elif 8 <= score <= 10: return "高リスク (High)"
-    else: return "非常に高リスク (Very High)"
+    return _RISK[max(1, min(15, score))]
 
 # -----------------------------
 # Final REBA Score Calculation Function
 # -----------------------------
+# Results of recent identical requests (paused video / client retries); least recently used entries are evicted first
+_RESULT_CACHE_SIZE: Final = 1024
+_result_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_result_cache_lock = threading.Lock() # Thread-pool workers share the cache
+
+def pack_calib(calib: CalibrationInputs) -> np.ndarray:
+    """ Calibration values in _CALIB_FIELDS order for the scoring kernels """
+    return np.array([getattr(calib, f) for f in _CALIB_FIELDS], dtype=np.float64)
+
+def build_response(angles: Dict[str, Any], scores: List[int]) -> Dict[str, Any]:
+    """ Response body for one frame from its named angles and the scoring kernel output """
+    return {
+        "final_score": scores[10], "risk_level": get_risk_level(scores[10]),
+        "computed_angles": angles,
+        "intermediate_scores": dict(zip(_SCORE_KEYS, scores))
+    }
+
 def get_final_reba_score(landmarks: List[Landmark], calib: CalibrationInputs) -> Dict[str, Any]:
     """ Calculates the final REBA score and intermediate values """
-    angles: Dict[str, Any] = {} # Initialize angles dict
-    try:
-        angles = compute_all_angles(landmarks, calib.filmingSide)
-    except HTTPException as e: raise e
-    except Exception as e:
-        print(f"ERROR during angle computation: {e}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Angle computation failed: {e}")
-
-    try:
-        # --- Flags ---
-        neck_twist_flag = calib.neckRotation > 0
-        neck_bend_flag = calib.neckLateralBending > 0
-        trunk_twist_flag = abs(angles.get("trunkRotationAngle", 0)) >= 5
-        trunk_bend_flag = calib.trunkLateralFlexion > 0
-
-        # --- Component Scores ---
-        neckScore = calc_neck_score_revised( angles.get("neckAngleMagnitude", 0), angles.get("neckIsExtension", False), neck_twist_flag, neck_bend_flag )
-        trunkScore = calc_trunk_score_revised( angles.get("trunkAngleMagnitude", 0), angles.get("trunkIsExtension", False), trunk_twist_flag, trunk_bend_flag )
-
-        # --- Leg Score ---
-        left_knee_angle = angles.get("leftKneeAngle"); right_knee_angle = angles.get("rightKneeAngle")
-        legScore = 1
-        if calib.postureCategory == "sittingWalking": legScore = 1
-        elif calib.postureCategory == "standingBoth":
-            score_left = calc_leg_score_unified(calib.postureCategory, left_knee_angle)
-            score_right = calc_leg_score_unified(calib.postureCategory, right_knee_angle)
-            legScore = max(score_left, score_right)
-        elif calib.postureCategory == "standingOne":
-            knee_angle_to_use = None
-            if calib.supportingLeg == "left": knee_angle_to_use = left_knee_angle
-            elif calib.supportingLeg == "right": knee_angle_to_use = right_knee_angle
-            if knee_angle_to_use is not None: legScore = calc_leg_score_unified(calib.postureCategory, knee_angle_to_use)
-            else: # Fallback
-                print(f"DEBUG: StandingOne - Supporting leg ('{calib.supportingLeg}') angle invalid or missing! Using max score.")
-                score_left = calc_leg_score_unified(calib.postureCategory, left_knee_angle)
-                score_right = calc_leg_score_unified(calib.postureCategory, right_knee_angle)
-                legScore = max(score_left, score_right)
-
-        # --- Limb Scores ---
-        side_to_eval_arm = calib.filmingSide
-        prefix = "L_" if side_to_eval_arm == "left" else "R_"
-        upperArmScore = calc_upper_arm_score_revised( angles.get(f"{side_to_eval_arm}UpperArmAngleMagnitude", 0), angles.get(f"{side_to_eval_arm}UpperArmIsExtension", False), calib.upperArmCorrection, calib.shoulderElevation, calib.gravityAssist )
-        forearmScore = calc_forearm_score( angles.get(f"{side_to_eval_arm}ElbowAngle") )
-        wristScore = calc_wrist_score( calib.wristBaseScore, calib.wristCorrection )
-
-        # --- Combine Scores ---
-        scoreA = getScoreA(trunkScore, neckScore, legScore, calib.loadForce, calib.shockForce)
-        scoreB = getScoreB(upperArmScore, forearmScore, wristScore, calib.coupling)
-        tableCScore = getTableCScore(scoreA, scoreB)
-        activityScore = calib.staticPosture + calib.repetitiveMovement + calib.unstableMovement
-        finalScore = tableCScore + activityScore
-        finalScore = max(1, min(15, finalScore)) # Clamp 1-15
-        riskLevel = get_risk_level(finalScore)
-
-        response_data = {
-            "final_score": finalScore, "risk_level": riskLevel,
-            "computed_angles": angles,
-            "intermediate_scores": {
-                 "neck": neckScore, "trunk": trunkScore, "leg": legScore,
-                 "upperArm": upperArmScore, "forearm": forearmScore, "wrist": wristScore,
-                 "scoreA": scoreA, "scoreB": scoreB, "tableC": tableCScore, "activity": activityScore
-            }
-        }
-        print("DEBUG: Returning data:", response_data) # Keep debug log
-        return response_data
-
-    except Exception as e:
-         print(f"ERROR: Unexpected error during REBA score calculation logic: {e}")
-         traceback.print_exc()
-         raise HTTPException(status_code=500, detail=f"Score calculation failed: {e}")
+    lms = Landmarks.from_models(landmarks) # Convert once; all downstream math indexes these arrays
+    cache_key = (lms.xy.tobytes(), lms.vis.tobytes(), calib) # CalibrationInputs is frozen, so hashable by value
+    with _result_cache_lock:
+        cached = _result_cache.get(cache_key)
+        if cached is not None:
+            _result_cache.move_to_end(cache_key)
+            return cached
+    # Unexpected errors propagate to the endpoint, which logs them once and returns 500
+    angle_arr = compute_angle_array(lms, calib.filmingSide)
+    angles = angles_to_dict(angle_arr.tolist())
+
+    # --- Component / Table / Activity / Final Scores (one kernel call) ---
+    side = 0 if calib.filmingSide == "left" else 1
+    scores = _compute_scores_nb(angle_arr, side, calib.postureCategory, calib.supportingLeg or "", pack_calib(calib)).tolist()
+    response_data = build_response(angles, scores)
+    with _result_cache_lock:
+        _result_cache[cache_key] = response_data
+        if len(_result_cache) > _RESULT_CACHE_SIZE: _result_cache.popitem(last=False)
+    return response_data
 
 # -----------------------------
 # API Endpoint
 # -----------------------------
-@app.post("/compute_reba")
-async def compute_reba_endpoint(input_data: REBAInput):
+def summarize(result: Dict[str, Any]) -> Dict[str, Any]:
+    """ ?verbose=false response: final score and risk level only (angles / intermediate scores omitted) """
+    return {"final_score": result["final_score"], "risk_level": result["risk_level"]}
+
+def _is_json_content_type(content_type: Optional[str]) -> bool:
+    """ FastAPI と同じ判定: ヘッダー無し、または application/json / application/*+json """
+    if not content_type: return True
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type == "application/json" or (media_type.startswith("application/") and media_type.endswith("+json"))
+
+async def parse_body(request: Request, adapter: TypeAdapter) -> Any:
+    """ Parses the raw body with orjson and validates it with pydantic-core (FastAPI の標準ボディ処理を経由しない) """
+    body = await request.body()
+    missing = RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    if not body: raise missing # FastAPI と同じく空のボディは "missing"
+    try:
+        # JSON 以外の Content-Type は FastAPI 同様パースせずバイト列のまま検証 (422)
+        if not _is_json_content_type(request.headers.get("content-type")): return adapter.validate_python(body)
+        try: data = orjson.loads(body)
+        except orjson.JSONDecodeError: return adapter.validate_json(body) # NaN/Infinity literals or invalid JSON: pydantic-core parses or reports it
+        if data is None: raise missing # JSON の null も FastAPI では "missing"
+        return adapter.validate_python(data)
+    except ValidationError as e:
+        # FastAPI 標準の 422 応答と同じ形式 (loc は "body" から始まる)。inf / NaN の入力値は JSON にできないので文字列で返す
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"]), **({"input": repr(err["input"])} if err["type"] == "finite_number" else {})}
+                                      for err in e.errors(include_url=False)])
+
+def _openapi_body(model: type) -> Dict[str, Any]:
+    """ openapi_extra documenting a body that parse_body reads itself ($defs are inlined: OpenAPI resolves "#/..." refs from the document root) """
+    schema = model.model_json_schema(); defs = schema.pop("$defs", {})
+    def inline(node: Any) -> Any:
+        if isinstance(node, dict):
+            if "$ref" in node: return inline(defs[node["$ref"].rsplit("/", 1)[-1]])
+            return {k: inline(v) for k, v in node.items()}
+        return [inline(v) for v in node] if isinstance(node, list) else node
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": inline(schema)}}}}
+
+def get_batch_reba_scores(frames: List[List[Landmark]], calib: CalibrationInputs) -> List[Dict[str, Any]]:
+    """ Scores all frames with one angle kernel call and one scoring kernel call (results in frame order) """
+    lms = Landmarks.batch_from_models(frames)
+    side = 0 if calib.filmingSide == "left" else 1
+    angle_arr = _compute_angles_batch_nb(lms.xy, lms.vis, side)
+    unreliable = int(np.count_nonzero(angle_arr[:, 13] == 0))
+    if unreliable:
+         logger.warning("Could not compute reliable midpoints (shoulder/hip) in %d of %d frames. Using defaults.", unreliable, len(frames))
+    scores = _compute_scores_batch_nb(angle_arr, side, calib.postureCategory, calib.supportingLeg or "", pack_calib(calib)).tolist()
+    return [build_response(angles_to_dict(a), s) for a, s in zip(angle_arr.tolist(), scores)]
+
+@app.post("/compute_reba", response_class=ORJSONResponse, openapi_extra=_openapi_body(REBAInput))
+async def compute_reba_endpoint(request: Request, verbose: bool = True):
+    input_data = await parse_body(request, _INPUT_ADAPTER)
+    if not input_data.landmarks or len(input_data.landmarks) <= MAX_LM_INDEX: # Check against max index needed (Ankle = 28)
+         raise HTTPException(status_code=400, detail=f"Insufficient landmarks provided ({len(input_data.landmarks)}).")
+    try:
+        # CPU-bound: run in the thread pool so the event loop keeps accepting requests
+        result = await run_in_threadpool(get_final_reba_score, input_data.landmarks, input_data.calibInputs)
+    except HTTPException: raise
+    except Exception as e: # The single place unexpected errors are logged (500 stays inside CORS, unlike a global handler)
+         logger.exception("Unhandled exception in /compute_reba endpoint")
+         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    # Response を直接返して jsonable_encoder / 出力検証を省略 (result は既にJSON互換の値のみ)
+    return ORJSONResponse(content=result if verbose else summarize(result))
+
+@app.post("/compute_reba_batch", response_class=ORJSONResponse, openapi_extra=_openapi_body(REBABatchInput))
+async def compute_reba_batch_endpoint(request: Request, verbose: bool = True):
+    batch = await parse_body(request, _BATCH_ADAPTER)
     try:
-        if not input_data.landmarks or len(input_data.landmarks) < 29: # Check against max index needed (Ankle = 28)
-             raise HTTPException(status_code=400, detail=f"Insufficient landmarks provided ({len(input_data.landmarks)}).")
-        # Pydantic validation runs implicitly
-
-        result = get_final_reba_score(input_data.landmarks, input_data.calibInputs)
-        return result
-    except HTTPException as e: raise e
-    except ValidationError as e: raise HTTPException(status_code=422, detail=e.errors())
+        # One thread-pool hop for the whole batch
+        results = await run_in_threadpool(get_batch_reba_scores, batch.frames, batch.calibInputs)
+    except HTTPException: raise
     except Exception as e:
-         print(f"ERROR: Unhandled exception in /compute_reba endpoint: {e}")
-         traceback.print_exc()
+         logger.exception("Unhandled exception in /compute_reba_batch endpoint")
          raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+    return ORJSONResponse(content=results if verbose else [summarize(r) for r in results])
 
 # -----------------------------
 # CORS Middleware
 # -----------------------------
-origins = [
-    "http://localhost",
-    "http://127.0.0.1",
-    "https://reba-1.onrender.com", # ★ ユーザー提供のフロントエンドURL ★
-]
+# localhost / 127.0.0.1 (任意のポート) と ★ ユーザー提供のフロントエンドURL ★ (Starlette が起動時に一度だけコンパイル)
+origin_regex = r"^(http://(localhost|127\.0\.0\.1)(:\d+)?|https://reba-1\.onrender\.com)$"
+app.add_middleware(GZipMiddleware, minimum_size=500) # Added first so CORS stays the outer layer
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=origins,
+    allow_origin_regex=origin_regex,
     allow_credentials=True,
     allow_methods=["POST", "GET"],
-    allow_headers=["*"],
+    allow_headers=["Content-Type"], # フロントエンド (script.js) が送るヘッダーのみ
+    max_age=86400, # Browsers may cache the preflight for 24h
 )
 
 # -----------------------------
@@ -0,0 +1,183 @@
+# 回帰テスト: python -m pytest -q (reba/ で実行)
+import json
+import math
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+client = TestClient(main.app)
+
+CALIB = dict(filmingSide="left", neckRotation=0, neckLateralBending=0, trunkLateralFlexion=0, loadForce=0, shockForce=0,
+             postureCategory="standingBoth", supportingLeg=None, upperArmCorrection=0, shoulderElevation=0, gravityAssist=0,
+             wristCorrection=0, wristBaseScore=1, staticPosture=0, repetitiveMovement=0, unstableMovement=0, coupling=0)
+
+# -----------------------------
+# Reference brackets (the original if/elif rules)
+# -----------------------------
+def ref_neck(angle, ext):
+    return 2 if (ext and angle > 5) or (not ext and angle > 20) else 1
+
+def ref_trunk(angle, ext):
+    if angle <= 5: return 1
+    if ext: return 2 if angle <= 20 else 3
+    return 2 if angle <= 20 else 3 if angle <= 60 else 4
+
+def ref_upper_arm(angle, ext):
+    if ext: return 2 if angle <= 20 else 3
+    return 1 if angle <= 20 else 2 if angle <= 45 else 3 if angle <= 90 else 4
+
+def ref_leg_add(knee):
+    flex = 180.0 - knee
+    return 1 if 30 <= flex <= 60 else 2 if flex > 60 else 0
+
+def ref_forearm(elbow):
+    return 1 if 80 <= elbow <= 120 else 2
+
+def around(*edges):
+    """ Each edge and its neighbouring doubles """
+    return [v for e in edges for v in (np.nextafter(e, -np.inf), e, np.nextafter(e, np.inf))]
+
+@pytest.mark.parametrize("angle", around(5.0, 20.0, 45.0, 60.0, 90.0) + [0.0, 10.0, 30.0, 75.0, 120.0, 180.0])
+@pytest.mark.parametrize("ext", [False, True])
+def test_neck_trunk_upper_arm_brackets(angle, ext):
+    assert main.calc_neck_score_revised(angle, ext, 0) == ref_neck(angle, ext)
+    assert main.calc_trunk_score_revised(angle, ext, 0) == ref_trunk(angle, ext)
+    assert main.calc_upper_arm_score_revised(angle, ext, 0) == ref_upper_arm(angle, ext)
+
+@pytest.mark.parametrize("knee", around(150.0, 120.0) + [0.0, 90.0, 160.0, 180.0])
+@pytest.mark.parametrize("posture", ["standingBoth", "standingOne"])
+def test_leg_brackets(knee, posture):
+    base = 1 if posture == "standingBoth" else 2
+    assert main.calc_leg_score_unified(posture, knee) == base + ref_leg_add(knee)
+    assert main.calc_leg_score_unified("sittingWalking", knee) == 1
+
+@pytest.mark.parametrize("elbow", around(80.0, 120.0) + [0.0, 90.0, 180.0])
+def test_forearm_brackets(elbow):
+    assert main.calc_forearm_score(elbow) == ref_forearm(elbow)
+
+def test_bracket_edges_by_value():
+    # 境界値そのものは下側のブラケット (膝屈曲 30 / 肘 80 は上側)
+    assert [main.calc_upper_arm_score_revised(a, False, 0) for a in (20.0, 45.0, 60.0, 90.0)] == [1, 2, 3, 3]
+    assert [main.calc_trunk_score_revised(a, False, 0) for a in (20.0, 60.0, 61.0)] == [2, 3, 4]
+    assert [main.calc_leg_score_unified("standingBoth", 180.0 - f) for f in (29.0, 30.0, 60.0, 61.0)] == [1, 2, 2, 3]
+    assert [main.calc_forearm_score(a) for a in (79.0, 80.0, 120.0, 121.0)] == [2, 1, 1, 2]
+
+# -----------------------------
+# End-to-end
+# -----------------------------
+def pose():
+    """ Upright pose (33 points, all visible): left elbow ~75 deg, right elbow 90 deg, left knee bent; y increases downwards """
+    lms = [{"x": 0.0, "y": 0.0, "visibility": 0.9} for _ in range(33)]
+    pts = {main.NOSE: (0.02, 0.1),
+           main.L_SHOULDER: (-0.1, 0.3), main.R_SHOULDER: (0.1, 0.3), main.L_HIP: (-0.1, 0.7), main.R_HIP: (0.1, 0.7),
+           main.L_ELBOW: (-0.2, 0.45), main.L_WRIST: (-0.05, 0.5), main.R_ELBOW: (0.1, 0.5), main.R_WRIST: (0.3, 0.5),
+           main.L_KNEE: (-0.1, 0.9), main.L_ANKLE: (-0.25, 1.05), main.R_KNEE: (0.1, 0.9), main.R_ANKLE: (0.1, 1.1)}
+    for i, (x, y) in pts.items(): lms[i].update(x=x, y=y)
+    return lms
+
+def post(lms, **calib):
+    r = client.post("/compute_reba", json={"landmarks": lms, "calibInputs": {**CALIB, **calib}})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+def test_pose_angles():
+    angles = post(pose())["computed_angles"]
+    assert angles["rightElbowAngle"] == pytest.approx(90.0) and angles["rightKneeAngle"] == pytest.approx(180.0)
+    assert angles["trunkAngleMagnitude"] == pytest.approx(180.0) # hip -> shoulder points up
+
+@pytest.mark.parametrize("missing", ["absent", "none"])
+def test_missing_visibility(missing):
+    lms = pose()
+    for i in (main.NOSE, main.L_SHOULDER, main.L_ELBOW):
+        if missing == "absent": del lms[i]["visibility"]
+        else: lms[i]["visibility"] = None
+    angles = post(lms)["computed_angles"]
+    # Midpoint / nose / upper-arm gates need a visibility (> 0.5, >= 0.5): missing counts as 0
+    assert angles["neckAngleMagnitude"] == 0.0 and angles["trunkAngleMagnitude"] == 0.0
+    assert angles["leftUpperArmAngleMagnitude"] == 0.0 and angles["leftUpperArmIsExtension"] is False
+    # Joint angles only reject visibility < 0.5: missing counts as visible
+    assert angles["leftElbowAngle"] > 0.0
+
+def test_missing_and_none_visibility_agree():
+    absent, none = pose(), pose()
+    del absent[main.R_ELBOW]["visibility"]; none[main.R_ELBOW]["visibility"] = None
+    assert post(absent) == post(none)
+
+def test_filming_side_right_uses_right_limbs():
+    lms = pose()
+    left, right = post(lms), post(lms, filmingSide="right")
+    # Angles are side independent; extension flags are mirrored by the filming side
+    assert {k: v for k, v in left["computed_angles"].items() if "IsExtension" not in k} == {k: v for k, v in right["computed_angles"].items() if "IsExtension" not in k}
+    assert left["intermediate_scores"]["forearm"] == main.calc_forearm_score(left["computed_angles"]["leftElbowAngle"])
+    assert right["intermediate_scores"]["forearm"] == main.calc_forearm_score(right["computed_angles"]["rightElbowAngle"])
+    assert left["intermediate_scores"]["forearm"] != right["intermediate_scores"]["forearm"]
+
+def test_filming_side_right_mirrors_left():
+    # x -> -x with left/right landmarks swapped: filming from the right must score like the original from the left
+    swap = {main.L_SHOULDER: main.R_SHOULDER, main.L_ELBOW: main.R_ELBOW, main.L_WRIST: main.R_WRIST,
+            main.L_HIP: main.R_HIP, main.L_KNEE: main.R_KNEE, main.L_ANKLE: main.R_ANKLE}
+    swap.update({v: k for k, v in swap.items()})
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        lms = [{"x": float(x), "y": float(y), "visibility": float(v)} for x, y, v in zip(rng.uniform(-1, 1, 33), rng.uniform(0, 1, 33), rng.uniform(0.4, 1, 33))]
+        mirrored = [dict(lms[swap.get(i, i)], x=-lms[swap.get(i, i)]["x"]) for i in range(33)]
+        a, b = post(lms), post(mirrored, filmingSide="right")
+        assert a["intermediate_scores"] == b["intermediate_scores"] and a["final_score"] == b["final_score"]
+        for side, other in (("left", "right"), ("right", "left")):
+            for key in ("UpperArmAngleMagnitude", "ElbowAngle", "KneeAngle"):
+                assert a["computed_angles"][side + key] == pytest.approx(b["computed_angles"][other + key], abs=1e-9)
+        assert a["computed_angles"]["leftUpperArmIsExtension"] == b["computed_angles"]["rightUpperArmIsExtension"]
+
+@pytest.mark.parametrize("literal", ["Infinity", "-Infinity", "NaN", "1e400"])
+def test_non_finite_coordinates_rejected(literal):
+    lms = pose(); lms[main.NOSE]["x"] = "@"
+    body = json.dumps({"landmarks": lms, "calibInputs": CALIB}).replace('"@"', literal)
+    r = client.post("/compute_reba", content=body, headers={"content-type": "application/json"})
+    assert r.status_code == 422, r.text
+    assert [(e["type"], e["loc"]) for e in r.json()["detail"]] == [("finite_number", ["body", "landmarks", 0, "x"])]
+
+@pytest.mark.parametrize("index", [main.L_KNEE, main.L_ELBOW, main.L_SHOULDER])
+@pytest.mark.parametrize("value", [1e200, -1e300])
+def test_overflowing_coordinates_score_as_failed_angles(index, value):
+    # Finite input, but |v|^2 overflows: the affected arccos angles report 0 like any other failed check
+    lms = pose(); lms[index]["x"] = value
+    result = post(lms)
+    assert all(isinstance(v, bool) or math.isfinite(v) for v in result["computed_angles"].values())
+    affected = {main.L_KNEE: ["leftKneeAngle"], main.L_ELBOW: ["leftElbowAngle", "leftUpperArmAngleMagnitude"],
+                main.L_SHOULDER: ["leftElbowAngle", "leftUpperArmAngleMagnitude"]}[index]
+    assert all(result["computed_angles"][k] == 0.0 for k in affected)
+
+@pytest.mark.parametrize("body", [b"", b"null"])
+def test_missing_body(body):
+    r = client.post("/compute_reba", content=body, headers={"content-type": "application/json"})
+    assert r.status_code == 422 and r.json()["detail"] == [{"type": "missing", "loc": ["body"], "msg": "Field required", "input": None}]
+
+def random_frames(n, seed):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(n):
+        frame = []
+        for x, y, v in zip(rng.uniform(0, 1, 33), rng.uniform(0, 1, 33), rng.uniform(0.3, 1, 33)):
+            p = {"x": float(x), "y": float(y)}
+            r = rng.random()
+            if r < 0.1: p["visibility"] = None
+            elif r > 0.2: p["visibility"] = float(v) # otherwise absent
+            frame.append(p)
+        frames.append(frame)
+    return frames
+
+@pytest.mark.parametrize("calib", [dict(), dict(filmingSide="right", postureCategory="standingOne", supportingLeg="right", loadForce=11, coupling=2)])
+def test_batch_matches_single(calib):
+    frames = random_frames(40, seed=1)
+    r = client.post("/compute_reba_batch", json={"frames": frames, "calibInputs": {**CALIB, **calib}})
+    assert r.status_code == 200, r.text
+    assert r.json() == [post(f, **calib) for f in frames]
+
+def test_batch_limits():
+    frames = random_frames(2, seed=2)
+    r = client.post("/compute_reba_batch", json={"frames": [frames[0], frames[1][:10]], "calibInputs": CALIB})
+    assert r.status_code == 400
+    r = client.post("/compute_reba_batch", json={"frames": frames * (main._MAX_BATCH_FRAMES // 2 + 1), "calibInputs": CALIB})
+    assert r.status_code == 422